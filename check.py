@@ -1,11 +1,19 @@
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from tabulate import tabulate
 from tqdm import tqdm
 import sys
-from time import time, sleep
+from time import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 import threading
+import queue
 import logging
+import math
+import sqlite3
+import re
 
 # Настройка логирования только в файл
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', filename='sui_checker.log')
@@ -13,20 +21,43 @@ logger = logging.getLogger(__name__)
 
 # Конфигурация
 SUI_RPC_URL = "https://fullnode.mainnet.sui.io:443"
+SUI_COIN_TYPE = "0x2::sui::SUI"
 COINGECKO_API_URL = "https://api.coingecko.com/api/v3/simple/price"
 WALLETS_FILE = "wallets.txt"
 TOKENS_FILE = "tokens.txt"
 PROXIES_FILE = "proxies.txt"
+CACHE_DB_FILE = "sui_cache.db"  # Постоянный кэш цен и decimals между запусками
 PRICE_CACHE_DURATION = 300  # 5 минут в секундах
 MIN_TOKEN_VALUE = 0.05  # Минимальная общая стоимость токена ($0.05)
 MAX_WORKERS = 10  # Максимальное количество параллельных потоков
-MAX_RETRIES = 3  # Максимальное количество попыток для запроса
+MAX_WALLET_WORKERS = 50  # Потоков для проверки кошельков (один запрос на кошелёк)
+MAX_RETRIES = 3  # Максимальное количество повторов запроса (urllib3 Retry)
+JSON_HEADERS = {"Content-Type": "application/json"}
 
-# Кэш для цен и decimals
+# Кэш для цен и decimals; цены хранятся как {tuple(sorted(символы)): (цены, время)}
 price_cache = {}
 decimals_cache = {}
 cache_lock = threading.Lock()
 
+# Кэш на диске: decimals не меняются, цены живут PRICE_CACHE_DURATION.
+# Соединение открывается при первом обращении и общее для всех потоков
+cache_db = None
+
+# Общая сессия: keep-alive соединения переиспользуются между запросами и потоками
+SESSION = requests.Session()
+# Повторы с экспоненциальной задержкой (и учётом Retry-After при 429) выполняет urllib3
+_retry = Retry(total=MAX_RETRIES, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504],
+               allowed_methods=["GET", "POST"], respect_retry_after_header=True)
+_adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WALLET_WORKERS, max_retries=_retry)
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
+
+# Отдельная сессия без повторов для проверки прокси: мёртвый прокси должен отсеиваться одной попыткой
+PROBE_SESSION = requests.Session()
+_probe_adapter = HTTPAdapter(pool_connections=MAX_WORKERS, max_retries=0)
+PROBE_SESSION.mount("http://", _probe_adapter)
+PROBE_SESSION.mount("https://", _probe_adapter)
+
 def load_file(filename):
     """Загружает строки из файла"""
     try:
@@ -57,19 +88,16 @@ def load_proxies():
     return proxies
 
 def test_proxy(proxy):
-    """Проверяет работоспособность прокси"""
-    for attempt in range(MAX_RETRIES):
-        try:
-            proxies = {'http': proxy, 'https': proxy}
-            response = requests.get("https://api.ipify.org", timeout=5, proxies=proxies)
-            response.raise_for_status()
-            logger.info(f"Прокси {proxy} работает.")
-            return proxy
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Прокси {proxy} не работает (попытка {attempt + 1}/{MAX_RETRIES}): {e}")
-            if attempt < MAX_RETRIES - 1:
-                sleep(2)
-    return None
+    """Проверяет работоспособность прокси одним HEAD-запросом"""
+    try:
+        proxies = {'http': proxy, 'https': proxy}
+        response = PROBE_SESSION.head("https://api.ipify.org", timeout=2, allow_redirects=False, proxies=proxies)
+        response.raise_for_status()
+        logger.info(f"Прокси {proxy} работает.")
+        return proxy
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Прокси {proxy} не работает: {e}")
+        return None
 
 def shorten_address(address, prefix_len=5, suffix_len=3):
     """Сокращает адрес в формате 0x123...456"""
@@ -77,11 +105,83 @@ def shorten_address(address, prefix_len=5, suffix_len=3):
         return f"{address[:prefix_len]}...{address[-suffix_len:]}"
     return address
 
+def get_cache_db():
+    """Открывает кэш на диске при первом обращении (вызывать под cache_lock)"""
+    global cache_db
+    if cache_db is None:
+        db = sqlite3.connect(CACHE_DB_FILE, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("CREATE TABLE IF NOT EXISTS decimals(token TEXT PRIMARY KEY, value INT)")
+        db.execute("CREATE TABLE IF NOT EXISTS prices(symbol TEXT PRIMARY KEY, usd REAL, ts REAL)")
+        db.commit()
+        cache_db = db
+    return cache_db
+
+# Кэш на диске необязателен: при ошибках sqlite (каталог только для чтения, "database is locked")
+# работаем с кэшем в памяти и сетью
+
+def load_cached_decimals(token_type):
+    """Достаёт decimals токена из кэша на диске и кладёт в кэш в памяти"""
+    with cache_lock:
+        try:
+            row = get_cache_db().execute("SELECT value FROM decimals WHERE token=?", (token_type,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Не удалось прочитать decimals для {token_type} из {CACHE_DB_FILE}: {e}")
+            return None
+        if row is None:
+            return None
+        decimals_cache[token_type] = row[0]
+    return row[0]
+
+def save_decimals(token_type, decimals):
+    """Сохраняет decimals токена в памяти и на диске"""
+    with cache_lock:
+        decimals_cache[token_type] = decimals
+        try:
+            db = get_cache_db()
+            db.execute("INSERT OR REPLACE INTO decimals(token, value) VALUES (?, ?)", (token_type, decimals))
+            db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Не удалось сохранить decimals для {token_type} в {CACHE_DB_FILE}: {e}")
+
+def load_cached_prices(token_symbols):
+    """Возвращает цены с диска, если для всех символов есть свежая запись"""
+    with cache_lock:
+        try:
+            rows = get_cache_db().execute("SELECT symbol, usd FROM prices WHERE ts > ?",
+                                          (time() - PRICE_CACHE_DURATION,)).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"Не удалось прочитать цены из {CACHE_DB_FILE}: {e}")
+            return None
+    cached = dict(rows)
+    if not all(symbol in cached for symbol in token_symbols):
+        return None
+    return {symbol: cached[symbol] for symbol in token_symbols}
+
+def save_prices(prices):
+    """Сохраняет цены на диске"""
+    now = time()
+    with cache_lock:
+        try:
+            db = get_cache_db()
+            db.executemany("INSERT OR REPLACE INTO prices(symbol, usd, ts) VALUES (?, ?, ?)",
+                           [(symbol, usd, now) for symbol, usd in prices.items()])
+            db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Не удалось сохранить цены в {CACHE_DB_FILE}: {e}")
+
 def get_token_prices(token_symbols, proxies=None):
     """Получает цены токенов из CoinGecko API с кэшированием"""
-    with cache_lock:
-        if "timestamp" in price_cache and time() - price_cache["timestamp"] < PRICE_CACHE_DURATION:
-            return price_cache["prices"]
+    # Попадание в кэш — один dict.get без блокировки; запись кортежа целиком атомарна под GIL
+    key = tuple(sorted(token_symbols))
+    hit = price_cache.get(key)
+    if hit and time() - hit[1] < PRICE_CACHE_DURATION:
+        return hit[0]
+
+    prices = load_cached_prices(token_symbols)
+    if prices is not None:
+        price_cache[key] = (prices, time())
+        return prices
 
     symbol_to_id = {
         "SUI": "sui",
@@ -93,46 +193,34 @@ def get_token_prices(token_symbols, proxies=None):
         "WAL": "walrus-2",
         "CERT": "volo-staked-sui"
     }
-    ids = [symbol_to_id.get(symbol, symbol.lower()) for symbol in token_symbols]
-    ids_str = ",".join(ids)
+    pairs = [(symbol, symbol_to_id.get(symbol, symbol.lower())) for symbol in token_symbols]
+    ids_str = ",".join(coin_id for _, coin_id in pairs)
     for proxy in proxies or [None]:
-        for attempt in range(MAX_RETRIES):
-            try:
-                proxies_dict = {'http': proxy, 'https': proxy} if proxy else None
-                response = requests.get(
-                    f"{COINGECKO_API_URL}?ids={ids_str}&vs_currencies=usd",
-                    timeout=5,
-                    proxies=proxies_dict
-                )
-                response.raise_for_status()
-                data = response.json()
-                prices = {symbol: data.get(symbol_to_id.get(symbol, symbol.lower()), {}).get("usd", 0.0)
-                          for symbol in token_symbols}
-                with cache_lock:
-                    price_cache["prices"] = prices
-                    price_cache["timestamp"] = time()
-                return prices
-            except requests.exceptions.HTTPError as e:
-                if response.status_code == 429:
-                    logger.warning("Превышен лимит запросов CoinGecko. Повтор через 60 секунд...")
-                    sleep(60)
-                    continue
-                logger.error(f"Ошибка при получении цен через прокси {proxy}: {e}")
-                return {symbol: 0.0 for symbol in token_symbols}
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Ошибка сети при использовании прокси {proxy}: {e}")
-                if attempt < MAX_RETRIES - 1:
-                    sleep(2)
-                    continue
-                if proxy is not None:
-                    break
-        return {symbol: 0.0 for symbol in token_symbols}
+        try:
+            proxies_dict = {'http': proxy, 'https': proxy} if proxy else None
+            response = SESSION.get(
+                f"{COINGECKO_API_URL}?ids={ids_str}&vs_currencies=usd",
+                timeout=5,
+                proxies=proxies_dict
+            )
+            response.raise_for_status()
+            data = orjson.loads(response.content)
+            prices = {symbol: data.get(coin_id, {}).get("usd", 0.0) for symbol, coin_id in pairs}
+            save_prices(prices)
+            price_cache[key] = (prices, time())
+            return prices
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
+            logger.error(f"Ошибка при получении цен через прокси {proxy}: {e}")
+    return {symbol: 0.0 for symbol in token_symbols}
 
 def get_token_decimals(token_type, proxies=None):
     """Получает количество decimals для токена"""
-    with cache_lock:
-        if token_type in decimals_cache:
-            return decimals_cache[token_type]
+    decimals = decimals_cache.get(token_type)
+    if decimals is not None:
+        return decimals
+    decimals = load_cached_decimals(token_type)
+    if decimals is not None:
+        return decimals
 
     payload = {
         "jsonrpc": "2.0",
@@ -141,106 +229,105 @@ def get_token_decimals(token_type, proxies=None):
         "params": [token_type]
     }
     for proxy in proxies or [None]:
-        for attempt in range(MAX_RETRIES):
-            try:
-                proxies_dict = {'http': proxy, 'https': proxy} if proxy else None
-                response = requests.post(SUI_RPC_URL, json=payload, timeout=5, proxies=proxies_dict)
-                response.raise_for_status()
-                data = response.json()
-                decimals = int(data['result']['decimals']) if 'result' in data and data['result'] else 9
-                with cache_lock:
-                    decimals_cache[token_type] = decimals
-                return decimals
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Ошибка при получении decimals для {token_type} (прокси: {proxy}, попытка {attempt + 1}/{MAX_RETRIES}): {e}")
-                if attempt < MAX_RETRIES - 1:
-                    sleep(2)
-                    continue
-                if proxy is not None:
-                    break
-        logger.warning(f"Используется 9 decimals для {token_type}")
-        return 9
-
-def get_sui_balance(wallet_address, proxy=None):
-    """Получает баланс SUI"""
-    payload = {
-        "jsonrpc": "2.0",
-        "id": 1,
-        "method": "suix_getBalance",
-        "params": [wallet_address]
-    }
-    for attempt in range(MAX_RETRIES):
         try:
-            proxies = {'http': proxy, 'https': proxy} if proxy else None
-            response = requests.post(SUI_RPC_URL, json=payload, timeout=10, proxies=proxies)
+            proxies_dict = {'http': proxy, 'https': proxy} if proxy else None
+            response = SESSION.post(SUI_RPC_URL, data=orjson.dumps(payload), headers=JSON_HEADERS, timeout=5, proxies=proxies_dict)
             response.raise_for_status()
-            data = response.json()
-            return int(data['result']['totalBalance']) / 10**9 if 'result' in data else 0.0
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Ошибка при получении баланса SUI для {wallet_address} (прокси: {proxy}, попытка {attempt + 1}/{MAX_RETRIES}): {e}")
-            if attempt < MAX_RETRIES - 1:
-                sleep(2)
-                continue
-            return 0.0
-
-def get_staked_sui(wallet_address, proxy=None):
-    """Получает стейкинг SUI"""
-    payload = {
-        "jsonrpc": "2.0",
-        "id": 1,
-        "method": "suix_getStakes",
-        "params": [wallet_address]
-    }
-    for attempt in range(MAX_RETRIES):
-        try:
-            proxies = {'http': proxy, 'https': proxy} if proxy else None
-            response = requests.post(SUI_RPC_URL, json=payload, timeout=10, proxies=proxies)
-            response.raise_for_status()
-            data = response.json()
-            return sum(int(staked_obj.get('principal', 0)) 
-                       for stake in data.get('result', []) 
-                       for staked_obj in stake.get('stakes', [])) / 10**9
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Ошибка при получении стейкинга SUI для {wallet_address} (прокси: {proxy}, попытка {attempt + 1}/{MAX_RETRIES}): {e}")
-            if attempt < MAX_RETRIES - 1:
-                sleep(2)
-                continue
-            return 0.0
-
-def get_token_balance(wallet_address, token_type, proxy=None):
-    """Получает баланс токена с учетом decimals"""
-    decimals = decimals_cache.get(token_type, 9)
-    payload = {
-        "jsonrpc": "2.0",
-        "id": 1,
-        "method": "suix_getBalance",
-        "params": [wallet_address, token_type]
-    }
-    for attempt in range(MAX_RETRIES):
-        try:
-            proxies = {'http': proxy, 'https': proxy} if proxy else None
-            response = requests.post(SUI_RPC_URL, json=payload, timeout=5, proxies=proxies)
-            response.raise_for_status()
-            data = response.json()
-            balance = int(data['result']['totalBalance']) if 'result' in data else 0
-            return balance / 10**decimals
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Ошибка при получении баланса токена {token_type} для {wallet_address} (прокси: {proxy}, попытка {attempt + 1}/{MAX_RETRIES}): {e}")
-            if attempt < MAX_RETRIES - 1:
-                sleep(2)
-                continue
-            return 0.0
+            data = orjson.loads(response.content)
+            if data.get('result'):
+                decimals = int(data['result']['decimals'])
+                save_decimals(token_type, decimals)
+                return decimals
+            with cache_lock:
+                decimals_cache[token_type] = 9
+            return 9
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
+            logger.error(f"Ошибка при получении decimals для {token_type} (прокси: {proxy}): {e}")
+    logger.warning(f"Используется 9 decimals для {token_type}")
+    return 9
+
+def rpc_batch(payloads, proxy=None):
+    """Отправляет пакет JSON-RPC запросов одним POST и возвращает результаты по id"""
+    try:
+        proxies = {'http': proxy, 'https': proxy} if proxy else None
+        response = SESSION.post(SUI_RPC_URL, data=orjson.dumps(payloads), headers=JSON_HEADERS, timeout=10, proxies=proxies)
+        response.raise_for_status()
+        data = orjson.loads(response.content)
+        if not isinstance(data, list):
+            raise requests.exceptions.RequestException(f"Неожиданный ответ на пакетный запрос: {data}")
+        results = {}
+        for resp in data:
+            if 'error' in resp:
+                logger.error(f"Ошибка RPC в пакетном запросе (id {resp.get('id')}): {resp['error']}")
+            results[resp.get('id')] = resp.get('result')
+        return results
+    except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
+        logger.error(f"Ошибка пакетного запроса (прокси: {proxy}): {e}")
+        return {}
+
+def prefetch_decimals(token_types, proxies=None):
+    """Кэширует decimals всех токенов одним пакетным запросом suix_getCoinMetadata"""
+    missing = [token_type for token_type in token_types
+               if token_type not in decimals_cache and load_cached_decimals(token_type) is None]
+    if not missing:
+        return
+    payloads = [{"jsonrpc": "2.0", "id": i, "method": "suix_getCoinMetadata", "params": [token_type]}
+                for i, token_type in enumerate(missing)]
+    results = {}
+    for proxy in proxies or [None]:
+        results = rpc_batch(payloads, proxy)
+        if results:
+            break
+    for i, token_type in enumerate(missing):
+        if i not in results:
+            # Пакет не дошёл — запрашиваем токен отдельно
+            get_token_decimals(token_type, proxies)
+            continue
+        metadata = results[i]
+        if metadata:
+            save_decimals(token_type, int(metadata['decimals']))
+            continue
+        logger.warning(f"Используется 9 decimals для {token_type}")
+        with cache_lock:
+            decimals_cache[token_type] = 9
+
+@lru_cache(maxsize=None)
+def normalize_coin_type(coin_type):
+    """Приводит адреса в типе монеты к полной форме 0x + 64 hex, как их отдаёт нода"""
+    return re.sub(r"0x([0-9a-fA-F]+)(?=::)", lambda m: "0x" + m.group(1).lower().zfill(64), coin_type)
+
+def get_all_balances_rpc(wallet_address, proxy=None):
+    """Получает сырые балансы всех монет и стейкинг SUI одним пакетным запросом"""
+    payloads = [
+        {"jsonrpc": "2.0", "id": 0, "method": "suix_getAllBalances", "params": [wallet_address]},
+        # Стейкинг запрашивается в том же пакете: отдельного запроса нет, а кошелёк
+        # может стейкать SUI при нулевом свободном балансе, поэтому пропускать его нельзя
+        {"jsonrpc": "2.0", "id": 1, "method": "suix_getStakes", "params": [wallet_address]}
+    ]
+    results = rpc_batch(payloads, proxy)
+    # Пустые списки балансов и стейков — тоже ответ; None хотя бы у одного вызова означает
+    # сбой запроса или ошибку RPC, иначе стейкинг молча занизится до нуля
+    got_any_result = results.get(0) is not None and results.get(1) is not None
+    balances = {normalize_coin_type(entry['coinType']): int(entry['totalBalance']) for entry in results.get(0) or []}
+    staked = sum(int(staked_obj.get('principal', 0))
+                 for stake in results.get(1) or []
+                 for staked_obj in stake.get('stakes', []))
+    return balances, staked, got_any_result
 
 def get_all_balances(wallet_address, token_types, proxy=None):
-    """Получает балансы SUI и токенов через отдельные запросы"""
-    sui_balance = get_sui_balance(wallet_address, proxy)
-    staked_sui = get_staked_sui(wallet_address, proxy)
+    """Получает балансы SUI, стейкинга и токенов одним пакетным запросом"""
+    raw_balances, raw_staked, got_any_result = get_all_balances_rpc(wallet_address, proxy)
+    # Ключи сравниваются в нормализованном виде: "0x2::sui::SUI" и адреса без ведущих нулей
+    # из tokens.txt иначе не совпали бы с coinType ноды
+    sui_balance = raw_balances.get(normalize_coin_type(SUI_COIN_TYPE), 0) / 10**9
+    staked_sui = raw_staked / 10**9
     token_balances = {}
     for token_type in token_types:
-        balance = get_token_balance(wallet_address, token_type, proxy)
-        token_balances[token_type] = balance
-    return sui_balance, staked_sui, token_balances
+        decimals = decimals_cache.get(token_type, 9)
+        token_balances[token_type] = raw_balances.get(normalize_coin_type(token_type), 0) / 10**decimals
+    return sui_balance, staked_sui, token_balances, got_any_result
 
+@lru_cache(maxsize=None)
 def get_token_symbol(token_type):
     """Извлекает символ токена из его типа"""
     parts = token_type.split("::")
@@ -255,35 +342,43 @@ def format_balance(balance, price):
     value = balance * price
     return f"{balance:,.2f} (${value:,.2f})"
 
-def process_wallet(wallet, index, token_types, proxies, prices):
+def process_wallet(wallet, index, token_types, proxies, proxy_queue, price_by_type, sui_price):
     """Обрабатывает один кошелёк"""
-    for attempt in range(len(proxies) if proxies else 1):
-        proxy = proxies[(index - 1 + attempt) % len(proxies)] if proxies else None
-        short_addr = shorten_address(wallet)
-        
-        sui_balance, staked_sui, token_balances = get_all_balances(wallet, token_types, proxy)
-        
-        if sui_balance or staked_sui or any(token_balances.values()):
-            break
-        logger.warning(f"Попытка {attempt + 1} не удалась для {short_addr} с прокси {proxy}. Пробуем другой прокси...")
-    
+    short_addr = shorten_address(wallet)
+    # Прокси берётся из общей очереди, чтобы потоки равномерно распределялись по всем прокси
+    slot = proxy_queue.get() if proxy_queue is not None else None
+    start = proxies.index(slot) if proxies else 0
+    try:
+        for attempt in range(len(proxies) if proxies else 1):
+            # Слот очереди удерживается до конца, а повторы идут по остальным прокси по кругу,
+            # поэтому каждая попытка использует другой прокси, а не только что упавший
+            proxy = proxies[(start + attempt) % len(proxies)] if proxies else None
+
+            sui_balance, staked_sui, token_balances, got_any_result = get_all_balances(wallet, token_types, proxy)
+
+            # Повторяем только при сбое RPC: нулевые балансы у пустого кошелька — нормальный ответ
+            if got_any_result:
+                break
+            logger.warning(f"Попытка {attempt + 1} не удалась для {short_addr} с прокси {proxy}. Пробуем другой прокси...")
+    finally:
+        if proxy_queue is not None:
+            proxy_queue.put(slot)
+
     af_sui_balance = 0.0
     v_sui_balance = 0.0
-    total_value = 0.0
-    if prices.get("SUI", 0.0) > 0:
-        total_value += (sui_balance + staked_sui) * prices["SUI"]
-    
-    formatted_balances = {}
+    total_value = (sui_balance + staked_sui) * sui_price
+
+    formatted_balances = []  # В порядке token_types
     for token in token_types:
         balance = token_balances[token]
+        price = price_by_type[token]
         token_symbol = get_token_symbol(token)
         if token_symbol == "AFSUI":
             af_sui_balance = balance
         elif token_symbol == "CERT":
             v_sui_balance = balance
-        if prices.get(token_symbol, 0.0) > 0:
-            total_value += balance * prices[token_symbol]
-        formatted_balances[token] = format_balance(balance, prices.get(token_symbol, 0.0))
+        total_value += balance * price
+        formatted_balances.append(format_balance(balance, price))
     
     total_sui = sui_balance + staked_sui + af_sui_balance + v_sui_balance
     total_value_str = f"${total_value:,.2f}" if total_value > 0 else "цена недоступна"
@@ -295,13 +390,13 @@ def process_wallet(wallet, index, token_types, proxies, prices):
         "staked_sui": staked_sui,
         "af_sui": af_sui_balance,
         "v_sui": v_sui_balance,
-        "token_balances": token_balances,
+        "balances_row": [token_balances[token] for token in token_types],
         "formatted_balances": formatted_balances,
         "total_sui": total_sui,
         "total_value": total_value,
-        "row": [index, short_addr, format_balance(sui_balance, prices.get("SUI", 0.0)),
-                format_balance(staked_sui, prices.get("SUI", 0.0)), formatted_balances,
-                format_balance(total_sui, prices.get("SUI", 0.0)), total_value_str]
+        "row": [index, short_addr, format_balance(sui_balance, sui_price),
+                format_balance(staked_sui, sui_price), formatted_balances,
+                format_balance(total_sui, sui_price), total_value_str]
     }
 
 def main():
@@ -317,7 +412,7 @@ def main():
     if proxies:
         valid_proxies = []
         failed_proxies = []
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        with ThreadPoolExecutor(max_workers=min(len(proxies), 64)) as executor:
             futures = {executor.submit(test_proxy, proxy): proxy for proxy in proxies}
             for future in tqdm(as_completed(futures), total=len(proxies), desc="Проверка прокси", file=sys.stdout):
                 proxy = futures[future]
@@ -341,82 +436,89 @@ def main():
             logger.info(f"Используем {len(proxies)} рабочих прокси: {proxies}")
 
     print("\nКэшируем decimals токенов...")
-    for token in token_types:
-        get_token_decimals(token, proxies)
+    prefetch_decimals(token_types, proxies)
 
     token_symbols = [get_token_symbol(token) for token in token_types]
     token_symbols_with_sui = ["SUI"] + token_symbols
 
     print("Получаем цены токенов...")
     prices = get_token_prices(token_symbols_with_sui, proxies)
+    price_by_type = {token: prices.get(get_token_symbol(token), 0.0) for token in token_types}
+    sui_price = prices.get("SUI", 0.0)
 
     table_data = []
-    token_balances_all = {token: [] for token in token_types}
+    balance_rows = []  # Балансы токенов по кошелькам в порядке token_types
     totals = {
         "sui": 0.0,
         "staked": 0.0,
         "af_sui": 0.0,
         "v_sui": 0.0,
-        "tokens": {token: 0.0 for token in token_types},
         "total_value": 0.0
     }
 
     print(f"\nПроверяем {len(wallets)} кошельков...")
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = [executor.submit(process_wallet, wallet, i, token_types, proxies, prices)
-                   for i, wallet in enumerate(wallets, 1)]
-        # Добавляем прогресс-бар, сохраняя порядок кошельков
-        for i, future in tqdm(enumerate(futures), total=len(wallets), desc="Проверка кошельков", file=sys.stdout):
+    proxy_queue = None
+    if proxies:
+        # Каждый прокси кладётся в очередь несколько раз, чтобы все потоки работали одновременно;
+        # порядок чередуется, поэтому нагрузка распределяется по прокси равномерно
+        proxy_queue = queue.SimpleQueue()
+        for _ in range(math.ceil(MAX_WALLET_WORKERS / len(proxies))):
+            for proxy in proxies:
+                proxy_queue.put(proxy)
+
+    with ThreadPoolExecutor(max_workers=min(len(wallets), MAX_WALLET_WORKERS)) as executor:
+        futures = {executor.submit(process_wallet, wallet, i, token_types, proxies, proxy_queue,
+                                   price_by_type, sui_price): i
+                   for i, wallet in enumerate(wallets, 1)}
+        # Прогресс-бар отражает реальное завершение; порядок кошельков восстанавливаем после
+        for future in tqdm(as_completed(futures), total=len(wallets), desc="Проверка кошельков", file=sys.stdout):
+            i = futures[future]
             try:
                 result = future.result()
                 table_data.append(result["row"])
-                for token in token_types:
-                    token_balances_all[token].append(result["token_balances"][token])
-                    totals["tokens"][token] += result["token_balances"][token]
+                balance_rows.append(result["balances_row"])
                 totals["sui"] += result["sui_balance"]
                 totals["staked"] += result["staked_sui"]
                 totals["af_sui"] += result["af_sui"]
                 totals["v_sui"] += result["v_sui"]
                 totals["total_value"] += result["total_value"]
             except Exception as e:
-                logger.error(f"Ошибка обработки кошелька {wallets[i]}: {e}")
+                logger.error(f"Ошибка обработки кошелька {wallets[i - 1]}: {e}")
 
+    table_data.sort(key=lambda row: row[0])
+
+    # Суммы считаются по столбцам целиком, а не по одному кошельку за раз
+    token_columns = list(zip(*balance_rows)) or [()] * len(token_types)
+    totals["tokens"] = {token: sum(column) for token, column in zip(token_types, token_columns)}
     significant_tokens = []
-    for token in token_types:
-        total_balance = totals["tokens"][token]
-        token_symbol = get_token_symbol(token)
-        token_value = total_balance * prices.get(token_symbol, 0.0)
-        has_non_zero_balance = any(balance > 0 for balance in token_balances_all[token])
+    for token, column in zip(token_types, token_columns):
+        token_value = totals["tokens"][token] * price_by_type[token]
+        has_non_zero_balance = max(column, default=0.0) > 0
         if has_non_zero_balance and token_value > MIN_TOKEN_VALUE:
             significant_tokens.append(token)
 
     significant_symbols = [get_token_symbol(token).replace("CERT", "VSUI") for token in significant_tokens]
     headers = ["#", "Адрес", "SUI", "Стейкинг"] + significant_symbols + ["Всего SUI", "Общая стоимость"]
 
-    final_table_data = []
-    for row in table_data:
-        token_balances = row[4]
-        new_row = row[:4]
-        new_row.extend([token_balances[token] for token in significant_tokens])
-        new_row.append(row[5])
-        new_row.append(row[6])
-        final_table_data.append(new_row)
+    sig_indices = [token_types.index(token) for token in significant_tokens]
+    final_table_data = [row[:4] + [row[4][i] for i in sig_indices] + [row[5], row[6]] for row in table_data]
 
     total_row = [
         "ИТОГО",
         f"{len(wallets)} кошельков",
-        format_balance(totals["sui"], prices.get("SUI", 0.0)),
-        format_balance(totals["staked"], prices.get("SUI", 0.0))
+        format_balance(totals["sui"], sui_price),
+        format_balance(totals["staked"], sui_price)
     ]
-    total_row.extend([format_balance(totals["tokens"][token], prices.get(get_token_symbol(token), 0.0))
+    total_row.extend([format_balance(totals["tokens"][token], price_by_type[token])
                       for token in significant_tokens])
     total_sui = totals["sui"] + totals["staked"] + totals["af_sui"] + totals["v_sui"]
-    total_row.append(format_balance(total_sui, prices.get("SUI", 0.0)))
+    total_row.append(format_balance(total_sui, sui_price))
     total_row.append(f"${totals['total_value']:,.2f}" if totals['total_value'] > 0 else "цена недоступна")
     final_table_data.append(total_row)
 
     print("\n" + "="*120)
-    print(tabulate(final_table_data, headers=headers, tablefmt="grid", numalign="right", stralign="right",
+    # Все ячейки уже отформатированы строками, поэтому разбор чисел в tabulate не нужен
+    print(tabulate(final_table_data, headers=headers, tablefmt="grid", stralign="right", disable_numparse=True,
                    maxcolwidths=[None, 20] + [25] * (len(headers) - 2)))
 
 if __name__ == "__main__":